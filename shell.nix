@@ -22,7 +22,11 @@ pkgs.mkShell {
     pythonPackages.pylint
     pythonPackages.black
     pythonPackages.pytest
-    pythonPackages.jsonschema
+    pythonPackages.pytest-xdist
+    pythonPackages.orjson
+    pythonPackages.fastjsonschema
+    pythonPackages.pyarrow
+    pythonPackages.filelock
     pythonPackages.venvShellHook
   ];
   venvDir = "venv";
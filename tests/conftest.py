@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2023 Technology Innovation Institute (TII)
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" pytest configuration for sbomnix tests """
+
+import os
+import hashlib
+import subprocess
+from pathlib import Path
+import pytest
+from filelock import FileLock
+
+TEST_CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "sbomnix-tests"
+)
+
+
+################################################################################
+
+
+@pytest.fixture(name="run_dir", scope="session")
+def shared_run_dir(tmp_path_factory):
+    """
+    Fixture that returns a temporary directory shared by all the pytest-xdist
+    workers of the current test run
+    """
+    basetemp = tmp_path_factory.getbasetemp()
+    if os.environ.get("PYTEST_XDIST_WORKER"):
+        # Worker basetemps are subdirectories of the test run basetemp
+        return basetemp.parent
+    return basetemp
+
+
+@pytest.fixture(name="nix_hello_drv", scope="session")
+def instantiate_nix_hello(run_dir):
+    """Fixture that returns the nixpkgs.hello derivation path"""
+    return hello_drv_path(run_dir)
+
+
+################################################################################
+
+
+def _nix_stdout(cmd):
+    """Run nix command, return the last line it wrote to stdout"""
+    stdout = subprocess.check_output(cmd, encoding="utf-8")
+    return stdout.strip().splitlines()[-1]
+
+
+def _is_immutable_nixpkgs(nixpkgs):
+    """
+    Return True if evaluating 'nixpkgs' always gives the same result: nixpkgs
+    is in the (immutable) nix store and there is no user nixpkgs
+    configuration or overlays that could change the evaluation
+    """
+    store_dir = Path(os.environ.get("NIX_STORE_DIR", "/nix/store"))
+    if store_dir not in nixpkgs.parents:
+        return False
+    if os.environ.get("NIXPKGS_CONFIG"):
+        return False
+    if "nixpkgs-overlays" in os.environ.get("NIX_PATH", ""):
+        return False
+    config_home = Path(os.environ.get("XDG_CONFIG_HOME", Path.home() / ".config"))
+    user_config_dirs = [config_home / "nixpkgs", Path.home() / ".nixpkgs"]
+    return not any(path.exists() for path in user_config_dirs)
+
+
+def hello_drv_path(run_dir):
+    """
+    Return the nixpkgs.hello derivation path, evaluating nixpkgs at most once
+    per test run. If '<nixpkgs>' in NIX_PATH is immutable, the derivation
+    path is also cached in TEST_CACHE_DIR across test runs, keyed by the
+    nixpkgs store path and the nix system.
+    (assumes nix-instantiate is available in $PATH)
+    """
+    nixpkgs = Path(_nix_stdout(["nix-instantiate", "--find-file", "nixpkgs"]))
+    nixpkgs = nixpkgs.resolve()
+    if _is_immutable_nixpkgs(nixpkgs):
+        cmd = ["nix-instantiate", "--eval", "--expr", "builtins.currentSystem"]
+        system = _nix_stdout(cmd)
+        key = hashlib.sha256(f"{nixpkgs}:{system}".encode()).hexdigest()[:16]
+        cache_file = TEST_CACHE_DIR / f"hello-{key}.drv"
+    else:
+        cache_file = run_dir / "hello.drv"
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    # Lock so that only one pytest-xdist worker evaluates nixpkgs
+    with FileLock(f"{cache_file}.lock"):
+        if cache_file.exists():
+            drv = cache_file.read_text(encoding="utf-8").strip()
+            if Path(drv).exists():
+                return drv
+        drv = _nix_stdout(["nix-instantiate", "<nixpkgs>", "-A", "hello"])
+        cache_file.write_text(drv, encoding="utf-8")
+    return drv
+
+
+################################################################################
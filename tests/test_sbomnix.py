@@ -3,47 +3,134 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-# pylint: disable=invalid-name
+# pylint: disable=invalid-name, import-outside-toplevel
 
 """ Tests for sbomnix """
 
 import os
+import hashlib
+import logging
 import subprocess
 import shutil
 from pathlib import Path
-import json
-import imghdr
-import pandas as pd
-import jsonschema
+from unittest.mock import patch
+import orjson
 import pytest
+from filelock import FileLock
 
 MYDIR = Path(os.path.dirname(os.path.realpath(__file__)))
-TEST_WORK_DIR = MYDIR / "sbomnix_test_data"
-TEST_NIX_RESULT = TEST_WORK_DIR / "result"
 SBOMNIX = MYDIR / ".." / "sbomnix" / "main.py"
 NIXGRAPH = MYDIR / ".." / "nixgraph" / "main.py"
 COMPARE_DEPS = MYDIR / "compare_deps.py"
-COMPARE_SBOMS = MYDIR / "compare_sboms.py"
+# nixgraph depth that covers the whole nixpkgs.hello dependency graph. nixgraph
+# stops at the leaves and skips already drawn edges regardless of the depth,
+# so a generous bound costs nothing, whereas a bound that is too small would
+# silently truncate the deep buildtime (stdenv bootstrap) graph.
+NIXGRAPH_FULL_DEPTH = 100
+# First bytes of every png file
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# CycloneDX sbom fields that change on every sbomnix run
+SBOM_VOLATILE_KEYS = {"serialNumber", "timestamp"}
 
 
 ################################################################################
 
 
-@pytest.fixture(autouse=True)
-def set_up_test_data():
-    """Fixture to set up the test data"""
+@pytest.fixture(name="nix_hello_result", scope="session")
+def build_nix_hello(tmp_path_factory, nix_hello_drv):
+    """
+    Fixture to build nixpkgs.hello once per test session (that is, once per
+    pytest-xdist worker), returns the path to the output symlink (gc root)
+    """
+    # Realise the nixpkgs.hello derivation, output symlink to nix_result
+    # (assumes nix-store is available in $PATH)
+    nix_result = tmp_path_factory.mktemp("nix_hello") / "result"
+    cmd = [
+        "nix-store",
+        "--realise",
+        nix_hello_drv,
+        "--add-root",
+        nix_result,
+        "--indirect",
+    ]
+    subprocess.check_call(cmd)
+    assert nix_result.exists()
+    return nix_result
+
+
+@pytest.fixture(name="work_dir")
+def set_up_test_data(tmp_path_factory, nix_hello_result):
+    """
+    Fixture to set up the test data: each test gets its own work directory
+    so that tests can run in parallel (pytest-xdist) without sharing files
+    """
     print("setup")
-    shutil.rmtree(TEST_WORK_DIR, ignore_errors=True)
-    TEST_WORK_DIR.mkdir(parents=True, exist_ok=True)
-    # Build nixpkgs.hello, output symlink to TEST_NIX_RESULT
-    # (assumes nix-build is available in $PATH)
-    cmd = ["nix-build", "<nixpkgs>", "-A", "hello", "-o", TEST_NIX_RESULT]
-    assert subprocess.run(cmd, check=True).returncode == 0
-    assert Path(TEST_NIX_RESULT).exists()
-    os.chdir(TEST_WORK_DIR)
-    yield "resource"
+    assert nix_hello_result.exists()
+    test_work_dir = tmp_path_factory.mktemp("sbomnix_test_data")
+    yield test_work_dir
     print("clean up")
-    shutil.rmtree(TEST_WORK_DIR)
+    shutil.rmtree(test_work_dir)
+
+
+@pytest.fixture(name="sbom_runtime_cdx", scope="session")
+def generate_sbom_runtime_cdx(run_dir, nix_hello_result):
+    """Fixture to generate the runtime CycloneDX sbom once per test run"""
+    out_dir = run_once(
+        run_dir / "sbom_runtime",
+        lambda out_dir: sbomnix_cdx(nix_hello_result, out_dir, "runtime"),
+    )
+    return out_dir / "sbom_cdx_runtime.json"
+
+
+@pytest.fixture(name="sbom_buildtime_cdx", scope="session")
+def generate_sbom_buildtime_cdx(run_dir, nix_hello_result):
+    """Fixture to generate the buildtime CycloneDX sbom once per test run"""
+    out_dir = run_once(
+        run_dir / "sbom_buildtime",
+        lambda out_dir: sbomnix_cdx(nix_hello_result, out_dir, "buildtime"),
+    )
+    return out_dir / "sbom_cdx_buildtime.json"
+
+
+@pytest.fixture(name="cdx_schema", scope="session")
+def compile_cdx_schema():
+    """
+    Fixture to compile the CycloneDX json schema once per test session
+    (that is, once per pytest-xdist worker), returns the validator function
+    """
+    import fastjsonschema
+
+    schema_path = MYDIR / "resources" / "cdx_bom-1.3.schema.json"
+    assert schema_path.exists()
+    schema_obj = orjson.loads(schema_path.read_bytes())
+    return fastjsonschema.compile(schema_obj, handlers={"http": resolve_remote_schema})
+
+
+@pytest.fixture(name="nixgraph_csv_runtime_full", scope="session")
+def generate_nixgraph_csv_runtime_full(run_dir, nix_hello_result):
+    """Fixture to generate the full runtime nixgraph csv once per test run"""
+    depth = f"--depth={NIXGRAPH_FULL_DEPTH}"
+    out_dir = run_once(
+        run_dir / "nixgraph_runtime",
+        lambda out_dir: nixgraph_csv(nix_hello_result, out_dir / "graph.csv", depth),
+    )
+    return out_dir / "graph.csv"
+
+
+@pytest.fixture(name="nixgraph_csv_buildtime_full", scope="session")
+def generate_nixgraph_csv_buildtime_full(run_dir, nix_hello_result):
+    """Fixture to generate the full buildtime nixgraph csv once per test run"""
+    depth = f"--depth={NIXGRAPH_FULL_DEPTH}"
+    out_dir = run_once(
+        run_dir / "nixgraph_buildtime",
+        lambda out_dir: nixgraph_csv(
+            nix_hello_result, out_dir / "graph.csv", depth, "--buildtime"
+        ),
+    )
+    return out_dir / "graph.csv"
+
+
+################################################################################
 
 
 def test_sbomnix_help():
@@ -51,70 +138,29 @@ def test_sbomnix_help():
     Test sbomnix command line argument: '-h'
     """
     cmd = [SBOMNIX, "-h"]
-    assert subprocess.run(cmd, check=True).returncode == 0
+    subprocess.check_call(cmd)
 
 
-def test_sbomnix_cdx_type_runtime():
+def test_sbomnix_cdx_type_runtime(cdx_schema, sbom_runtime_cdx):
     """
     Test sbomnix '--type=runtime' generates valid CycloneDX json
     """
-
-    out_path_cdx = TEST_WORK_DIR / "sbom_cdx_test.json"
-    cmd = [
-        SBOMNIX,
-        TEST_NIX_RESULT,
-        "--cdx",
-        out_path_cdx.as_posix(),
-        "--type",
-        "runtime",
-    ]
-    assert subprocess.run(cmd, check=True).returncode == 0
-    assert out_path_cdx.exists()
-    schema_path = MYDIR / "resources" / "cdx_bom-1.3.schema.json"
-    assert schema_path.exists()
-    validate_json(out_path_cdx.as_posix(), schema_path)
+    cdx_schema(orjson.loads(sbom_runtime_cdx.read_bytes()))
 
 
-def test_sbomnix_cdx_type_buildtime():
+def test_sbomnix_cdx_type_buildtime(cdx_schema, sbom_buildtime_cdx):
     """
-    Test sbomnix '--type=runtime' generates valid CycloneDX json
+    Test sbomnix '--type=buildtime' generates valid CycloneDX json
     """
-
-    out_path_cdx = TEST_WORK_DIR / "sbom_cdx_test.json"
-    cmd = [
-        SBOMNIX,
-        TEST_NIX_RESULT,
-        "--cdx",
-        out_path_cdx.as_posix(),
-        "--type",
-        "buildtime",
-    ]
-    assert subprocess.run(cmd, check=True).returncode == 0
-    assert out_path_cdx.exists()
-    schema_path = MYDIR / "resources" / "cdx_bom-1.3.schema.json"
-    assert schema_path.exists()
-    validate_json(out_path_cdx.as_posix(), schema_path)
+    cdx_schema(orjson.loads(sbom_buildtime_cdx.read_bytes()))
 
 
-def test_sbomnix_cdx_type_both():
+def test_sbomnix_cdx_type_both(cdx_schema, work_dir, nix_hello_result):
     """
     Test sbomnix '--type=both' generates valid CycloneDX json
     """
-
-    out_path_cdx = TEST_WORK_DIR / "sbom_cdx_test.json"
-    cmd = [
-        SBOMNIX,
-        TEST_NIX_RESULT,
-        "--cdx",
-        out_path_cdx.as_posix(),
-        "--type",
-        "both",
-    ]
-    assert subprocess.run(cmd, check=True).returncode == 0
-    assert out_path_cdx.exists()
-    schema_path = MYDIR / "resources" / "cdx_bom-1.3.schema.json"
-    assert schema_path.exists()
-    validate_json(out_path_cdx.as_posix(), schema_path)
+    out_path_cdx = sbomnix_cdx(nix_hello_result, work_dir, "both")
+    cdx_schema(orjson.loads(out_path_cdx.read_bytes()))
 
 
 ################################################################################
@@ -125,76 +171,64 @@ def test_nixgraph_help():
     Test nixgraph command line argument: '-h'
     """
     cmd = [NIXGRAPH, "-h"]
-    assert subprocess.run(cmd, check=True).returncode == 0
+    subprocess.check_call(cmd)
 
 
-def test_nixgraph_png():
+def test_nixgraph_png(work_dir, nix_hello_result):
     """
     Test nixgraph with png output generates valid png image
     """
-    png_out = TEST_WORK_DIR / "graph.png"
-    cmd = [NIXGRAPH, TEST_NIX_RESULT, "--out", png_out, "--depth", "3"]
-    assert subprocess.run(cmd, check=True).returncode == 0
+    png_out = work_dir / "graph.png"
+    argv = [nix_hello_result, "--out", png_out, "--depth", "3"]
+    assert run_cli(nixgraph_main, argv) == 0
     assert Path(png_out).exists()
     # Check the output is valid png file
-    assert imghdr.what(png_out) == "png"
+    with open(png_out, "rb") as png_file:
+        assert png_file.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE
 
 
-def test_nixgraph_csv():
+def test_nixgraph_csv(work_dir, nix_hello_result):
     """
     Test nixgraph with csv output generates valid csv
     """
-    csv_out = TEST_WORK_DIR / "graph.csv"
-    cmd = [NIXGRAPH, TEST_NIX_RESULT, "--out", csv_out, "--depth", "3"]
-    assert subprocess.run(cmd, check=True).returncode == 0
+    csv_out = work_dir / "graph.csv"
+    argv = [nix_hello_result, "--out", csv_out, "--depth", "3"]
+    assert run_cli(nixgraph_main, argv) == 0
     assert Path(csv_out).exists()
     # Check the output is valid csv file
-    df_out = pd.read_csv(csv_out)
+    df_out = read_graph_csv(csv_out)
     assert not df_out.empty
 
 
-def test_nixgraph_csv_buildtime():
+def test_nixgraph_csv_buildtime(work_dir, nix_hello_result):
     """
     Test nixgraph with buildtime csv output generates valid csv
     """
-    csv_out = TEST_WORK_DIR / "graph_buildtime.csv"
-    cmd = [NIXGRAPH, TEST_NIX_RESULT, "--out", csv_out, "--buildtime"]
-    assert subprocess.run(cmd, check=True).returncode == 0
+    csv_out = work_dir / "graph_buildtime.csv"
+    argv = [nix_hello_result, "--out", csv_out, "--buildtime"]
+    assert run_cli(nixgraph_main, argv) == 0
     assert Path(csv_out).exists()
     # Check the output is valid csv file
-    df_out = pd.read_csv(csv_out)
+    df_out = read_graph_csv(csv_out)
     assert not df_out.empty
 
 
-def test_nixgraph_csv_graph_inverse():
+def test_nixgraph_csv_graph_inverse(
+    work_dir, nix_hello_result, nixgraph_csv_runtime_full
+):
     """
     Test nixgraph with '--inverse' argument
     """
-    csv_out = TEST_WORK_DIR / "graph.csv"
-    cmd = [
-        NIXGRAPH,
-        TEST_NIX_RESULT,
-        "--out",
-        csv_out,
-        "--depth=100",
-    ]
-    assert subprocess.run(cmd, check=True).returncode == 0
-    assert Path(csv_out).exists()
-    df_out = pd.read_csv(csv_out)
+    df_out = read_graph_csv(nixgraph_csv_runtime_full)
     assert not df_out.empty
 
-    csv_out_inv = TEST_WORK_DIR / "graph_inverse.csv"
-    cmd = [
-        NIXGRAPH,
-        TEST_NIX_RESULT,
-        "--out",
-        csv_out_inv,
-        "--depth=100",
+    csv_out_inv = nixgraph_csv(
+        nix_hello_result,
+        work_dir / "graph_inverse.csv",
+        f"--depth={NIXGRAPH_FULL_DEPTH}",
         "--inverse=libunistring",
-    ]
-    assert subprocess.run(cmd, check=True).returncode == 0
-    assert Path(csv_out_inv).exists()
-    df_out_inv = pd.read_csv(csv_out_inv)
+    )
+    df_out_inv = read_graph_csv(csv_out_inv)
     assert not df_out_inv.empty
 
     # When 'depth' covers the entire graph, the output from
@@ -203,10 +237,10 @@ def test_nixgraph_csv_graph_inverse():
     # compare the two dataframes
 
     df_out = df_out.drop("graph_depth", axis=1)
-    df_out = df_out.sort_values(by=["src_path"])
+    df_out = df_out.sort_values(by=df_out.columns.tolist())
 
     df_out_inv = df_out_inv.drop("graph_depth", axis=1)
-    df_out_inv = df_out_inv.sort_values(by=["src_path"])
+    df_out_inv = df_out_inv.sort_values(by=df_out_inv.columns.tolist())
 
     df_diff = df_difference(df_out, df_out_inv)
     assert df_diff.empty, df_to_string(df_diff)
@@ -215,128 +249,207 @@ def test_nixgraph_csv_graph_inverse():
 ################################################################################
 
 
-def test_compare_deps_runtime():
+def test_compare_deps_runtime(sbom_runtime_cdx, nixgraph_csv_runtime_full):
     """
     Compare nixgraph vs sbom runtime dependencies
     """
-    graph_csv_out = TEST_WORK_DIR / "graph.csv"
     cmd = [
-        NIXGRAPH,
-        TEST_NIX_RESULT,
-        "--out",
-        graph_csv_out,
-        "--depth=100",
+        COMPARE_DEPS,
+        "--sbom",
+        sbom_runtime_cdx,
+        "--graph",
+        nixgraph_csv_runtime_full,
     ]
-    assert subprocess.run(cmd, check=True).returncode == 0
-    assert Path(graph_csv_out).exists()
+    subprocess.check_call(cmd)
 
-    out_path_cdx = TEST_WORK_DIR / "sbom_cdx_test.json"
-    cmd = [
-        SBOMNIX,
-        TEST_NIX_RESULT,
-        "--cdx",
-        out_path_cdx.as_posix(),
-        "--type",
-        "runtime",
-    ]
-    assert subprocess.run(cmd, check=True).returncode == 0
-    assert out_path_cdx.exists()
 
+def test_compare_deps_buildtime(sbom_buildtime_cdx, nixgraph_csv_buildtime_full):
+    """
+    Compare nixgraph vs sbom buildtime dependencies
+    """
     cmd = [
         COMPARE_DEPS,
         "--sbom",
-        out_path_cdx,
+        sbom_buildtime_cdx,
         "--graph",
-        graph_csv_out,
+        nixgraph_csv_buildtime_full,
     ]
-    assert subprocess.run(cmd, check=True).returncode == 0
+    subprocess.check_call(cmd)
 
 
-def test_compare_deps_buildtime():
+def test_compare_sboms(work_dir, nix_hello_result, sbom_buildtime_cdx):
     """
-    Compare nixgraph vs sbom buildtime dependencies
+    Compare two sbomnix runs with same target produce the same sbom
     """
-    graph_csv_out = TEST_WORK_DIR / "graph.csv"
-    cmd = [
-        NIXGRAPH,
-        TEST_NIX_RESULT,
-        "--out",
-        graph_csv_out,
-        "--depth=100",
-        "--buildtime",
-    ]
-    assert subprocess.run(cmd, check=True).returncode == 0
-    assert Path(graph_csv_out).exists()
+    out_path_cdx = sbomnix_cdx(nix_hello_result, work_dir, "buildtime")
+    sbom1 = load_scrubbed_sbom(sbom_buildtime_cdx)
+    sbom2 = load_scrubbed_sbom(out_path_cdx)
+    if sbom_fingerprint(sbom1) == sbom_fingerprint(sbom2):
+        return
+    # Describe the difference: first the components only in one of the sboms,
+    # then anything else that differs
+    assert sbom_components(sbom1) == sbom_components(sbom2)
+    assert sbom1 == sbom2
 
-    out_path_cdx = TEST_WORK_DIR / "sbom_cdx_test.json"
-    cmd = [
-        SBOMNIX,
-        TEST_NIX_RESULT,
+
+################################################################################
+
+
+# Heavy modules (pandas, via sbomnix and nixgraph too) are imported in the
+# functions that need them, so that test collection and e.g. the '-h' tests
+# don't pay for importing them
+
+
+def sbomnix_main():
+    """sbomnix entry point"""
+    from sbomnix.main import main
+
+    load_cpe_dict()
+    main()
+
+
+def load_cpe_dict():
+    """
+    Load the sbomnix CPE dictionary holding a file lock: if the cached
+    dictionary is missing or outdated, CPE() runs update-cpedict.sh, which
+    doesn't write its output atomically, so concurrent pytest-xdist workers
+    must not run it at the same time
+    """
+    from sbomnix.cpe import CPE, CACHE_DIR
+
+    cache_dir = Path(CACHE_DIR).expanduser()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with FileLock(cache_dir / "cpes.csv.lock"):
+        CPE()
+
+
+def nixgraph_main():
+    """nixgraph entry point"""
+    from nixgraph.main import main
+
+    main()
+
+
+def run_cli(main_fn, argv):
+    """
+    Run command line entry point 'main_fn' in-process with arguments 'argv',
+    return the exit status
+    """
+    # main_fn sets up logging on each call: restore the logger handlers
+    # afterwards so the handlers don't pile up over the test session
+    from sbomnix.utils import LOGGER_NAME
+
+    logger = logging.getLogger(LOGGER_NAME)
+    handlers = logger.handlers[:]
+    try:
+        with patch("sys.argv", ["prog", *[str(arg) for arg in argv]]):
+            main_fn()
+    except SystemExit as e:
+        return 0 if e.code is None else e.code
+    finally:
+        logger.handlers = handlers
+    return 0
+
+
+def run_once(out_dir, generate):
+    """
+    Call generate(out_dir) unless another worker of this test run already did,
+    return out_dir. Session-scoped fixtures run once per pytest-xdist worker: the
+    file lock makes the workers of one test run share the generated files
+    instead of each generating their own copy.
+    """
+    with FileLock(f"{out_dir}.lock"):
+        if not out_dir.exists():
+            out_dir.mkdir()
+            try:
+                generate(out_dir)
+            except BaseException:
+                # Let the next worker try again instead of using partial output
+                shutil.rmtree(out_dir, ignore_errors=True)
+                raise
+    return out_dir
+
+
+def sbomnix_cdx(nix_path, out_dir, sbom_type):
+    """Run sbomnix with '--type=sbom_type', return path to the CycloneDX sbom"""
+    out_path_cdx = out_dir / f"sbom_cdx_{sbom_type}.json"
+    argv = [
+        nix_path,
         "--cdx",
         out_path_cdx.as_posix(),
+        "--csv",
+        (out_dir / f"sbom_csv_{sbom_type}.csv").as_posix(),
         "--type",
-        "buildtime",
+        sbom_type,
     ]
-    assert subprocess.run(cmd, check=True).returncode == 0
+    assert run_cli(sbomnix_main, argv) == 0
     assert out_path_cdx.exists()
+    return out_path_cdx
 
-    cmd = [
-        COMPARE_DEPS,
-        "--sbom",
-        out_path_cdx,
-        "--graph",
-        graph_csv_out,
-    ]
-    assert subprocess.run(cmd, check=True).returncode == 0
+
+def nixgraph_csv(nix_path, csv_out, *args):
+    """Run nixgraph with csv output and extra 'args', return path to the csv"""
+    argv = [nix_path, "--out", csv_out, *args]
+    assert run_cli(nixgraph_main, argv) == 0
+    assert csv_out.exists()
+    return csv_out
 
 
-def test_compare_sboms():
+def resolve_remote_schema(uri):
     """
-    Compare two sbomnix runs with same target produce the same sbom
+    Resolve remote json schema references without network access: the
+    cyclonedx schema only refers to 'spdx.schema.json', which is pinned in
+    the test resources
     """
-    out_path_cdx_1 = TEST_WORK_DIR / "sbom_cdx_test_1.json"
-    cmd = [
-        SBOMNIX,
-        TEST_NIX_RESULT,
-        "--cdx",
-        out_path_cdx_1.as_posix(),
-        "--type",
-        "buildtime",
-    ]
-    assert subprocess.run(cmd, check=True).returncode == 0
-    assert out_path_cdx_1.exists()
+    if uri.endswith("/spdx.schema.json"):
+        return orjson.loads((MYDIR / "resources" / "spdx.schema.json").read_bytes())
+    raise ValueError(f"Unexpected remote schema reference: '{uri}'")
 
-    out_path_cdx_2 = TEST_WORK_DIR / "sbom_cdx_test_2.json"
-    cmd = [
-        SBOMNIX,
-        TEST_NIX_RESULT,
-        "--cdx",
-        out_path_cdx_2.as_posix(),
-        "--type",
-        "buildtime",
-    ]
-    assert subprocess.run(cmd, check=True).returncode == 0
-    assert out_path_cdx_2.exists()
 
-    cmd = [
-        COMPARE_SBOMS,
-        out_path_cdx_1,
-        out_path_cdx_2,
-    ]
-    assert subprocess.run(cmd, check=True).returncode == 0
+def read_graph_csv(csv_path):
+    """
+    Read nixgraph csv output into dataframe, using the pyarrow csv engine and
+    arrow-backed dtypes if pandas and pyarrow support them
+    """
+    import importlib.util
+    import pandas as pd
 
+    options = {"engine": "c"}
+    if importlib.util.find_spec("pyarrow") is not None:
+        options = {"engine": "pyarrow"}
+        # 'dtype_backend' was added in pandas 2.0
+        if int(pd.__version__.split(".", maxsplit=1)[0]) >= 2:
+            options["dtype_backend"] = "pyarrow"
+    return pd.read_csv(csv_path, **options)
 
-################################################################################
 
+def _scrub_volatile(obj):
+    """Return copy of json object 'obj' without the SBOM_VOLATILE_KEYS"""
+    if isinstance(obj, dict):
+        return {
+            key: _scrub_volatile(val)
+            for key, val in obj.items()
+            if key not in SBOM_VOLATILE_KEYS
+        }
+    if isinstance(obj, list):
+        return [_scrub_volatile(val) for val in obj]
+    return obj
 
-def validate_json(file_path, schema_path):
-    """Validate json file matches schema"""
-    with open(file_path, encoding="utf-8") as json_file, open(
-        schema_path, encoding="utf-8"
-    ) as schema_file:
-        json_obj = json.load(json_file)
-        schema_obj = json.load(schema_file)
-        jsonschema.validate(json_obj, schema_obj)
+
+def load_scrubbed_sbom(path):
+    """Load sbom json file, ignoring fields that change per run"""
+    return _scrub_volatile(orjson.loads(Path(path).read_bytes()))
+
+
+def sbom_fingerprint(sbom):
+    """Return hash of the scrubbed sbom json object"""
+    return hashlib.blake2b(orjson.dumps(sbom, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def sbom_components(sbom):
+    """Return the set of (name, version) of the sbom components"""
+    components = sbom["components"] + [sbom["metadata"]["component"]]
+    return {(cmp["name"], cmp["version"]) for cmp in components}
 
 
 def df_to_string(df):
@@ -348,25 +461,36 @@ def df_to_string(df):
     )
 
 
+def df_rows(df):
+    """Return dataframe rows as a list of hashable tuples, NaN as None"""
+    df = df.astype(object).where(df.notna(), None)
+    return list(map(tuple, df.to_numpy()))
+
+
 def df_difference(df_left, df_right):
     """Return dataframe that represents diff of two dataframes"""
-    df_right = df_right.astype(df_left.dtypes.to_dict())
-    df = df_left.merge(
-        df_right,
-        how="outer",
-        indicator=True,
-    )
-    # Keep only the rows that differ (that are not in both)
-    df = df[df["_merge"] != "both"]
-    # Rename 'left_only' and 'right_only' values in '_merge' column
-    df["_merge"] = df["_merge"].replace(["left_only"], "EXPECTED ==>  ")
-    df["_merge"] = df["_merge"].replace(["right_only"], "RESULT ==>  ")
-    # Re-order columns: last column ('_merge') becomes first
-    cols = df.columns.tolist()
-    cols = cols[-1:] + cols[:-1]
-    df = df[cols]
-    # Rename '_merge' column to empty string
-    df = df.rename(columns={"_merge": ""})
+    import pandas as pd
+
+    if not df_right.dtypes.equals(df_left.dtypes):
+        df_right = df_right.astype(df_left.dtypes.to_dict())
+    df_right = df_right[df_left.columns]
+    if df_left.shape == df_right.shape and df_left.reset_index(drop=True).equals(
+        df_right.reset_index(drop=True)
+    ):
+        # Fast path: the dataframes are equal row by row
+        left_only = right_only = []
+    else:
+        left_rows = df_rows(df_left)
+        right_rows = df_rows(df_right)
+        # Keep only the rows that differ (that are not in both)
+        left_set = set(left_rows)
+        right_set = set(right_rows)
+        left_only = [row for row in dict.fromkeys(left_rows) if row not in right_set]
+        right_only = [row for row in dict.fromkeys(right_rows) if row not in left_set]
+    df = pd.DataFrame(left_only + right_only, columns=df_left.columns)
+    # Mark the rows with an unnamed first column
+    markers = ["EXPECTED ==>  "] * len(left_only) + ["RESULT ==>  "] * len(right_only)
+    df.insert(0, "", markers)
     return df
 
 